@@ -5,12 +5,15 @@ Supports both Groq API (cloud) and local Whisper (faster-whisper).
 """
 
 import argparse
+import io
 import os
 import sys
 import queue
+import re
+import shutil
 import subprocess
 import threading
-import tempfile
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -29,11 +32,24 @@ USE_LOCAL = False
 
 # Configuration
 SAMPLE_RATE = 16000
-CHUNK_DURATION = 3.0  # Longer chunks = less hallucination
+BLOCK_DURATION = 0.1  # Audio is read from parec in blocks of this length
+SILENCE_PEAK = int(0.02 * 32768)  # Blocks whose int16 peak stays below this count as silence
+PAUSE_DURATION = 0.5  # Silence after speech that ends an utterance
+MIN_UTTERANCE_DURATION = 1.5  # Shorter clips = more hallucination, keep collecting past pauses
+MAX_UTTERANCE_DURATION = 4.0  # Continuous speech is flushed so a line fits the overlay and keeps up
 WORD_FADE_MS = 3000  # Each word fades after 3 seconds
+OPUS_BITRATE = "24k"  # Groq uploads are compressed to Opus when ffmpeg is available
+FFMPEG_TIMEOUT_S = 2.0  # Opus encoding taking longer than this falls back to WAV
+GROQ_MAX_INFLIGHT = 4  # Concurrent Groq requests; more risks rate limiting (429)
+GROQ_KEEPALIVE_S = 60.0  # Idle Groq connections stay open this long (httpx default: 5 s)
 HISTORY_FILE = Path("transcript_history.txt")
 
-# Known Whisper hallucinations to filter out
+# Scale factors between int16 PCM and float32 samples in [-1, 1), kept as
+# float32 scalars so NumPy never has to promote a Python float
+INT16_TO_FLOAT = np.float32(1 / 2**15)
+FLOAT_TO_INT16 = np.float32(2**15 - 1)
+
+# Known Whisper hallucinations to filter out, matched anywhere in the text
 HALLUCINATION_FILTERS = [
     "vielen dank",
     "danke fürs zuschauen",
@@ -44,11 +60,32 @@ HALLUCINATION_FILTERS = [
     "subtitles by",
     "thank you for watching",
     "thanks for watching",
+]
+# Single-word hallucinations, matched only as whole words
+# (as substrings "amen" would also drop e.g. "Namen")
+HALLUCINATION_WORDS = [
     "subscribe",
     "abonnieren",
     "amen",
     "amén",
 ]
+# Compiled into one alternation so a transcript is scanned once
+HALLUCINATION_PATTERN = re.compile("|".join(
+    [re.escape(phrase) for phrase in HALLUCINATION_FILTERS]
+    + [rf"\b{re.escape(word)}\b" for word in HALLUCINATION_WORDS]
+))
+
+
+def int16_to_float(pcm: np.ndarray) -> np.ndarray:
+    """Convert int16 PCM to float32 samples in one vectorized pass, no temporaries."""
+    return np.multiply(pcm, INT16_TO_FLOAT, dtype=np.float32)
+
+
+def float_to_int16(audio: np.ndarray) -> np.ndarray:
+    """Convert float32 samples back to int16 PCM, scaling and casting in one pass."""
+    pcm = np.empty(len(audio), dtype=np.int16)
+    np.multiply(audio, FLOAT_TO_INT16, out=pcm, casting='unsafe')
+    return pcm
 
 
 def is_hallucination(text: str) -> bool:
@@ -56,10 +93,7 @@ def is_hallucination(text: str) -> bool:
     text_lower = text.lower().strip()
     if len(text_lower) < 3:
         return True
-    for pattern in HALLUCINATION_FILTERS:
-        if pattern in text_lower:
-            return True
-    return False
+    return HALLUCINATION_PATTERN.search(text_lower) is not None
 
 
 class TranscriptionSignals(QObject):
@@ -70,37 +104,63 @@ class TranscriptionSignals(QObject):
 class AudioCapture:
     def __init__(self, sample_rate: int = SAMPLE_RATE):
         self.sample_rate = sample_rate
-        self.audio_queue = queue.Queue()
+        # Bounded so a stalled consumer blocks the reader instead of growing memory
+        self.audio_queue = queue.Queue(maxsize=round(MAX_UTTERANCE_DURATION * 2 / BLOCK_DURATION))
         self.running = False
         self.process = None
         self.monitor_source = None
         self.read_thread = None
 
-    def find_monitor_source(self) -> str | None:
+    def find_monitor_source(self) -> str:
+        try:
+            import pulsectl
+        except (ImportError, OSError) as e:  # OSError: libpulse itself is missing
+            print(f"libpulse unavailable ({e}), using default monitor", file=sys.stderr)
+            return "@DEFAULT_MONITOR@"
         try:
-            result = subprocess.run(
-                ['pactl', 'list', 'sources', 'short'],
-                capture_output=True, text=True
-            )
-            for line in result.stdout.split('\n'):
-                if 'monitor' in line.lower() and line.strip():
-                    parts = line.split('\t')
-                    if len(parts) >= 2:
-                        return parts[1]
-        except FileNotFoundError:
-            pass
+            with pulsectl.Pulse('livesub') as pulse:
+                for source in pulse.source_list():
+                    if source.monitor_of_sink_name:
+                        return source.name
+        except pulsectl.PulseError as e:
+            print(f"Could not list PulseAudio sources ({e}), using default monitor", file=sys.stderr)
         return "@DEFAULT_MONITOR@"
 
+    def read_block(self, fd: int, size: int) -> bytearray | None:
+        """Read exactly size bytes from the parec pipe, None at EOF.
+
+        The pipe is unbuffered and read(2) writes straight into the block, so
+        there is no intermediate copy through Python's buffered IO.
+        """
+        block = bytearray(size)
+        view = memoryview(block)
+        filled = 0
+        while filled < size:
+            n = os.readv(fd, [view[filled:]])
+            if not n:
+                return None
+            filled += n
+        return block
+
     def read_audio_loop(self):
-        chunk_bytes = int(self.sample_rate * 0.1) * 2
-        while self.running and self.process and self.process.poll() is None:
-            try:
-                data = self.process.stdout.read(chunk_bytes)
-                if data:
-                    audio = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
-                    self.audio_queue.put(audio)
-            except Exception:
-                pass
+        chunk_bytes = int(self.sample_rate * BLOCK_DURATION) * 2
+        fd = self.process.stdout.fileno()
+        try:
+            while self.running and self.process and self.process.poll() is None:
+                try:
+                    # Raw bytes are queued; conversion happens once per utterance
+                    data = self.read_block(fd, chunk_bytes)
+                    if data is None:
+                        break  # parec closed its end of the pipe
+                    pcm = np.frombuffer(data, dtype=np.int16)
+                    # Python ints so that -(-32768) doesn't wrap around in int16
+                    peak = max(-int(pcm.min()), int(pcm.max()))
+                    self.audio_queue.put((data, peak))
+                except Exception:
+                    pass
+        finally:
+            # Sentinel wakes up get_utterance once parec is gone
+            self.audio_queue.put(None)
 
     def start(self):
         self.monitor_source = self.find_monitor_source()
@@ -109,7 +169,7 @@ class AudioCapture:
             '--format=s16le', '--rate', str(self.sample_rate),
             '--channels', '1', '--latency-msec=20'
         ]
-        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
         self.running = True
         self.read_thread = threading.Thread(target=self.read_audio_loop, daemon=True)
         self.read_thread.start()
@@ -120,47 +180,104 @@ class AudioCapture:
             self.process.terminate()
             self.process.wait(timeout=2)
 
-    def get_chunk(self, duration: float) -> np.ndarray | None:
-        samples_needed = int(self.sample_rate * duration)
-        collected = []
-        collected_samples = 0
-        while collected_samples < samples_needed and self.running:
-            try:
-                data = self.audio_queue.get(timeout=0.5)
-                collected.append(data)
-                collected_samples += len(data)
-            except queue.Empty:
-                if not self.running:
-                    return None
-        if not collected:
-            return None
-        return np.concatenate(collected, axis=0)[:samples_needed].flatten()
+    def get_utterance(self) -> np.ndarray | None:
+        """Collect audio from just before the first loud block until a pause or the length cap.
+
+        Blocks are classified by their int16 peak (a cheap energy VAD), so
+        utterance boundaries fall on pauses and pure silence is never returned.
+        """
+        pause_blocks = round(PAUSE_DURATION / BLOCK_DURATION)
+        min_samples = int(self.sample_rate * MIN_UTTERANCE_DURATION)
+        # Sized for the longest utterance; pages past the written part are never touched
+        out = np.empty(int(self.sample_rate * MAX_UTTERANCE_DURATION), dtype=np.int16)
+        written = 0
+        silent_blocks = 0
+        preroll = None
+        while written < len(out):
+            item = self.audio_queue.get()
+            if item is None:
+                return None
+            data, peak = item
+            if peak < SILENCE_PEAK:
+                if not written:
+                    preroll = data  # Still waiting for speech to start
+                    continue
+                silent_blocks += 1
+            else:
+                silent_blocks = 0
+                if not written and preroll is not None:
+                    # Soft word onsets often sit in the block just below the threshold
+                    pcm = np.frombuffer(preroll, dtype=np.int16)
+                    out[:len(pcm)] = pcm
+                    written = len(pcm)
+            pcm = np.frombuffer(data, dtype=np.int16)
+            n = min(len(pcm), len(out) - written)
+            np.copyto(out[written:written + n], pcm[:n])
+            written += n
+            if silent_blocks >= pause_blocks and written >= min_samples:
+                break
+        return int16_to_float(out[:written])
 
 
 class GroqTranscriber:
     def __init__(self):
-        from groq import Groq
+        import httpx
+        from groq import DefaultHttpxClient, Groq
         api_key = os.getenv('GROQ')
         if not api_key:
             raise ValueError("GROQ API key not found in .env")
-        self.client = Groq(api_key=api_key)
+        # One connection per in-flight request, kept alive across pauses in speech
+        # so each upload reuses an open TLS session instead of handshaking again
+        http_client = DefaultHttpxClient(limits=httpx.Limits(
+            max_connections=GROQ_MAX_INFLIGHT,
+            max_keepalive_connections=GROQ_MAX_INFLIGHT,
+            keepalive_expiry=GROQ_KEEPALIVE_S,
+        ))
+        self.client = Groq(api_key=api_key, http_client=http_client)
+        self.ffmpeg = shutil.which('ffmpeg')
+
+    def encode_opus(self, audio_int16: np.ndarray, sample_rate: int) -> bytes | None:
+        """Compress audio to Ogg/Opus, roughly 10x smaller than WAV."""
+        if not self.ffmpeg:
+            return None
+        cmd = [
+            self.ffmpeg, '-loglevel', 'error',
+            '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', '-',
+            '-c:a', 'libopus', '-b:a', OPUS_BITRATE, '-f', 'ogg', '-'
+        ]
+        try:
+            result = subprocess.run(cmd, input=audio_int16.tobytes(), capture_output=True,
+                                    timeout=FFMPEG_TIMEOUT_S)
+        except (subprocess.TimeoutExpired, OSError) as e:
+            error = str(e)
+        else:
+            if result.returncode == 0:
+                return result.stdout
+            error = result.stderr.decode(errors='replace').strip()
+        # Most likely built without libopus or hanging; don't retry on every chunk
+        print(f"ffmpeg Opus encoding failed, uploading WAV: {error}", file=sys.stderr)
+        self.ffmpeg = None
+        return None
 
     def transcribe(self, audio: np.ndarray, sample_rate: int) -> str:
-        audio_int16 = (audio * 32767).astype(np.int16)
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
-            temp_path = f.name
-            wavfile.write(temp_path, sample_rate, audio_int16)
-        try:
-            with open(temp_path, 'rb') as audio_file:
-                transcription = self.client.audio.transcriptions.create(
-                    file=(temp_path, audio_file.read()),
-                    model="whisper-large-v3-turbo",
-                    response_format="text",
-                    language="de",
-                )
-            return transcription.strip() if transcription else ""
-        finally:
-            os.unlink(temp_path)
+        audio_int16 = float_to_int16(audio)
+        opus = self.encode_opus(audio_int16, sample_rate)
+        if opus:
+            upload = ("audio.ogg", opus, "audio/ogg")
+        else:
+            # Build the WAV container in memory instead of round-tripping through disk
+            buf = io.BytesIO()
+            wavfile.write(buf, sample_rate, audio_int16)
+            upload = ("audio.wav", buf.getvalue(), "audio/wav")
+        # Groq's Whisper endpoint has no streaming mode, the text arrives in one
+        # response; latency is hidden by keeping several requests in flight instead
+        transcription = self.client.audio.transcriptions.create(
+            file=upload,
+            model="whisper-large-v3-turbo",
+            response_format="text",
+            language="de",
+        )
+        return transcription.strip() if transcription else ""
 
 
 class LocalTranscriber:
@@ -196,13 +313,16 @@ class LocalTranscriber:
 class TranscriptHistory:
     def __init__(self, filepath: Path = HISTORY_FILE):
         self.filepath = filepath
-        with open(self.filepath, 'a', encoding='utf-8') as f:
-            f.write(f"\n--- {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n")
+        # Kept open for the whole session; line buffering flushes every transcript
+        self.file = open(self.filepath, 'a', encoding='utf-8', buffering=1)
+        self.file.write(f"\n--- {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---\n")
 
     def append(self, text: str):
         if text.strip():
-            with open(self.filepath, 'a', encoding='utf-8') as f:
-                f.write(f"{text}\n")
+            self.file.write(f"{text}\n")
+
+    def close(self):
+        self.file.close()
 
 
 class TranscriptionOverlay(QMainWindow):
@@ -215,11 +335,17 @@ class TranscriptionOverlay(QMainWindow):
         # Two lines of text
         self.line1 = ""  # older line (top)
         self.line2 = ""  # current line (bottom)
-        self.line2_time = 0
+        # Text currently shown in the labels, to skip no-op setText repaints
+        self._last_line1 = None
+        self._last_line2 = None
 
+        # One-shot timers armed when text changes, so nothing runs while idle
         self.fade_timer = QTimer()
-        self.fade_timer.timeout.connect(self.check_fade)
-        self.fade_timer.start(100)
+        self.fade_timer.setSingleShot(True)
+        self.fade_timer.timeout.connect(self.fade_line2)
+        self.clear_timer = QTimer()
+        self.clear_timer.setSingleShot(True)
+        self.clear_timer.timeout.connect(self.clear_line1)
 
         self.history = TranscriptHistory()
         self.init_ui()
@@ -274,36 +400,35 @@ class TranscriptionOverlay(QMainWindow):
         # Move current line2 to line1, new text becomes line2
         if self.line2:
             self.line1 = self.line2
+            self.clear_timer.stop()
         self.line2 = text
-        self.line2_time = datetime.now().timestamp() * 1000
         self.update_display()
+        # Restarting cancels the fade scheduled for the previous line
+        self.fade_timer.start(WORD_FADE_MS)
 
-    def check_fade(self):
-        """Fade out old text."""
-        if not self.line2:
-            return
-        now = datetime.now().timestamp() * 1000
-        age = now - self.line2_time
-
-        # After WORD_FADE_MS, move line2 to line1 and clear
-        if age > WORD_FADE_MS:
-            if self.line2:
-                self.line1 = self.line2
-                self.line2 = ""
-                self.line2_time = now
-                self.update_display()
-
-        # Clear line1 after another fade period
-        if self.line1 and not self.line2 and age > WORD_FADE_MS * 0.5:
-            self.line1 = ""
-            self.update_display()
+    def fade_line2(self):
+        """After WORD_FADE_MS, move line2 to line1 and clear it."""
+        self.line1 = self.line2
+        self.line2 = ""
+        self.update_display()
+        self.clear_timer.start(WORD_FADE_MS // 2)
+
+    def clear_line1(self):
+        """Clear line1 after another half fade period."""
+        self.line1 = ""
+        self.update_display()
 
     def update_display(self):
-        self.label1.setText(self.line1)
-        self.label2.setText(self.line2)
+        if self.line1 != self._last_line1:
+            self.label1.setText(self.line1)
+            self._last_line1 = self.line1
+        if self.line2 != self._last_line2:
+            self.label2.setText(self.line2)
+            self._last_line2 = self.line2
 
     def show_error(self, error: str):
-        self.label2.setText(f"Error: {error}")
+        self._last_line2 = f"Error: {error}"
+        self.label2.setText(self._last_line2)
         self.label2.setStyleSheet("color: #FF6666;")
 
     def mousePressEvent(self, event):
@@ -322,6 +447,8 @@ class TranscriptionOverlay(QMainWindow):
         if event.key() == Qt.Key.Key_Escape:
             QApplication.quit()
         elif event.key() == Qt.Key.Key_C:
+            self.fade_timer.stop()
+            self.clear_timer.stop()
             self.line1 = ""
             self.line2 = ""
             self.update_display()
@@ -332,32 +459,56 @@ class LiveTranscriptionApp:
         self.audio_capture = AudioCapture()
         if use_local:
             self.transcriber = LocalTranscriber(model_size)
+            max_inflight = 1  # Local model is CPU-bound, running it in parallel gains nothing
         else:
             self.transcriber = GroqTranscriber()
+            max_inflight = GROQ_MAX_INFLIGHT
+        self.executor = ThreadPoolExecutor(max_workers=max_inflight)
+        self.inflight = threading.BoundedSemaphore(max_inflight)
+        self.pending = queue.Queue()  # Futures in capture order
         self.running = False
 
     def transcription_loop(self, signals: TranscriptionSignals):
         while self.running:
             try:
-                audio = self.audio_capture.get_chunk(CHUNK_DURATION)
+                audio = self.audio_capture.get_utterance()
                 if audio is None:
                     continue
-                if np.abs(audio).max() < 0.02:
-                    continue
-                text = self.transcriber.transcribe(audio, SAMPLE_RATE)
+                # Keep capturing while earlier utterances are still in flight
+                self.inflight.acquire()
+                future = self.executor.submit(self.transcriber.transcribe, audio, SAMPLE_RATE)
+                future.add_done_callback(lambda _: self.inflight.release())
+                self.pending.put(future)
+            except Exception as e:
+                signals.error.emit(str(e))
+
+    def emit_loop(self, signals: TranscriptionSignals):
+        """Emit finished transcriptions in the order their audio was captured."""
+        while self.running:
+            future = self.pending.get()
+            if future is None:
+                break
+            try:
+                text = future.result()
                 if text and not is_hallucination(text):
                     signals.new_text.emit(text)
+            except CancelledError:
+                pass  # Dropped by executor.shutdown() while quitting
             except Exception as e:
-                signals.error.emit(str(e))
+                if self.running:
+                    signals.error.emit(str(e))
 
     def start(self, signals: TranscriptionSignals):
         self.audio_capture.start()
         self.running = True
         threading.Thread(target=self.transcription_loop, args=(signals,), daemon=True).start()
+        threading.Thread(target=self.emit_loop, args=(signals,), daemon=True).start()
 
     def stop(self):
         self.running = False
+        self.pending.put(None)
         self.audio_capture.stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 
 def main():
@@ -382,6 +533,7 @@ def main():
         print(f"Error: {e}", file=sys.stderr)
 
     app.aboutToQuit.connect(transcription_app.stop)
+    app.aboutToQuit.connect(overlay.history.close)
     sys.exit(app.exec())
 
 